@@ -236,6 +236,9 @@ def main():
             if dmri_pipeline is not None:
                 dmri_pipeline.parcellation_scheme = anat_pipeline.parcellation_scheme
                 dmri_pipeline.atlas_info = anat_pipeline.atlas_info
+                if args.number_of_threads is not None:
+                    print(f'  .. INFO: Set MRtrix tractography to use {args.number_of_threads} threads')
+                    dmri_pipeline.stages['Diffusion'].config.mrtrix_tracking_config.number_of_threads = args.number_of_threads
 
                 if dmri_valid_inputs:
                     dmri_pipeline.process()
@@ -324,6 +327,9 @@ def main():
             if dmri_pipeline is not None:
                 dmri_pipeline.parcellation_scheme = anat_pipeline.parcellation_scheme
                 dmri_pipeline.atlas_info = anat_pipeline.atlas_info
+                if args.number_of_threads is not None:
+                    print(f'  .. INFO: Set MRtrix tractography to use {args.number_of_threads} threads')
+                    dmri_pipeline.stages['Diffusion'].config.mrtrix_tracking_config.number_of_threads = args.number_of_threads
 
                 if dmri_valid_inputs:
                     print(">> Process diffusion pipeline")
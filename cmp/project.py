@@ -790,6 +790,8 @@ def run_individual(bids_dir, output_dir, participant_label, session_label, anat_
             if dmri_pipeline is not None:
                 dmri_pipeline.parcellation_scheme = anat_pipeline.parcellation_scheme
                 dmri_pipeline.atlas_info = anat_pipeline.atlas_info
+                print('--- Set MRtrix tractography to use {} threads'.format(number_of_threads))
+                dmri_pipeline.stages['Diffusion'].config.mrtrix_tracking_config.number_of_threads = number_of_threads
                 if dmri_valid_inputs:
                     dmri_pipeline.process()
                 else:
@@ -882,6 +884,8 @@ def run_individual(bids_dir, output_dir, participant_label, session_label, anat_
             if dmri_pipeline is not None:
                 dmri_pipeline.parcellation_scheme = anat_pipeline.parcellation_scheme
                 dmri_pipeline.atlas_info = anat_pipeline.atlas_info
+                print('--- Set MRtrix tractography to use {} threads'.format(number_of_threads))
+                dmri_pipeline.stages['Diffusion'].config.mrtrix_tracking_config.number_of_threads = number_of_threads
                 # print sys.argv[offset+7]
                 if dmri_valid_inputs:
                     print(">> Process diffusion pipeline")
@@ -15,15 +15,20 @@ from nipype import logging
 
 # import matplotlib.pyplot as plt
 
-from cmtklib.interfaces.mrtrix3 import Erode, StreamlineTrack, FilterTractogram
+from cmtklib.interfaces.mrtrix3 import StreamlineTrack, FilterTractogram
 from cmtklib.interfaces.dipy import DirectionGetterTractography, TensorInformedEudXTractography
-from cmtklib.interfaces.misc import ExtractHeaderVoxel2WorldMatrix
-from cmtklib.diffusion import Tck2Trk, Make_Mrtrix_Seeds
+from cmtklib.diffusion import Tck2Trk
 
 # from cmtklib.diffusion import filter_fibers
 
 iflogger = logging.getLogger('nipype.interface')
 
+# Default maximum curvature for each (tracking_mode, SD) combination
+_CURV = {("Deterministic", False): 2.0,
+         ("Deterministic", True): 0.0,
+         ("Probabilistic", False): 1.0,
+         ("Probabilistic", True): 1.0}
+
 
 class Dipy_tracking_config(HasTraits):
     """Class used to store Dipy diffusion reconstruction sub-workflow configuration parameters.
@@ -103,12 +108,7 @@ class Dipy_tracking_config(HasTraits):
         new
             New value of ``SD``
         """
-        if self.tracking_mode == "Deterministic" and not new:
-            self.curvature = 2.0
-        elif self.tracking_mode == "Deterministic" and new:
-            self.curvature = 0.0
-        elif self.tracking_mode == "Probabilistic":
-            self.curvature = 1.0
+        self.curvature = _CURV.get((self.tracking_mode, bool(new)), self.curvature)
 
     def _tracking_mode_changed(self, new):
         """Update ``curvature``, ``use_act`` and ``seed_from_gmwmi`` when ``tracking_mode`` is updated.
@@ -118,16 +118,10 @@ class Dipy_tracking_config(HasTraits):
         new
             New value of ``tracking_mode``
         """
-        if new == "Deterministic" and not self.SD:
-            self.curvature = 2.0
+        self.curvature = _CURV.get((new, bool(self.SD)), self.curvature)
+        if new == "Deterministic":
             self.use_act = False
             self.seed_from_gmwmi = False
-        elif new == "Deterministic" and self.SD:
-            self.curvature = 0.0
-            self.use_act = False
-            self.seed_from_gmwmi = False
-        elif new == "Probabilistic":
-            self.curvature = 1.0
 
     def _curvature_changed(self, new):
         """Set ``curvature`` to 0 if ``curvature`` is updated to a value <= 0.000001.
@@ -209,6 +203,10 @@ class MRtrix_tracking_config(HasTraits):
     sift : traits.Bool
         Filter tractogram using mrtrix3 SIFT
         (Default: True)
+
+    number_of_threads : traits.Int
+        Number of threads used by `tckgen` to generate the streamlines
+        (Default: 0, i.e. use the MRtrix default)
     """
 
     tracking_mode = Str
@@ -234,6 +232,9 @@ class MRtrix_tracking_config(HasTraits):
 
     sift = traits.Bool(True, desc="Filter tractogram using mrtrix3 SIFT")
 
+    number_of_threads = Int(0, desc="Number of threads used by tckgen to generate the streamlines "
+                                    "(0: use the MRtrix default)")
+
     def _SD_changed(self, new):
         """Update ``curvature`` when ``SD`` is updated.
 
@@ -242,12 +243,7 @@ class MRtrix_tracking_config(HasTraits):
         new
             New value of ``SD``
         """
-        if self.tracking_mode == "Deterministic" and not new:
-            self.curvature = 2.0
-        elif self.tracking_mode == "Deterministic" and new:
-            self.curvature = 0.0
-        elif self.tracking_mode == "Probabilistic":
-            self.curvature = 1.0
+        self.curvature = _CURV.get((self.tracking_mode, bool(new)), self.curvature)
 
     def _use_act_changed(self, new):
         if new is False:
@@ -263,12 +259,7 @@ class MRtrix_tracking_config(HasTraits):
         new
             New value of ``tracking_mode``
         """
-        if new == "Deterministic" and not self.SD:
-            self.curvature = 2.0
-        elif new == "Deterministic" and self.SD:
-            self.curvature = 0.0
-        elif new == "Probabilistic":
-            self.curvature = 1.0
+        self.curvature = _CURV.get((new, bool(self.SD)), self.curvature)
 
     def _curvature_changed(self, new):
         """Set ``curvature`` to 0 if ``curvature`` is updated to a value <= 0.000001.
@@ -315,62 +306,23 @@ def create_dipy_tracking_flow(config):
 
         flow.connect([
             # (dipy_seeds,dipy_tracking,[('seed_files','seed_file')]),
-            (inputnode, dipy_tracking, [('wm_mask_resampled', 'seed_mask')]),
-            (inputnode, dipy_tracking, [('DWI', 'in_file')]),
-            (inputnode, dipy_tracking, [('model', 'in_model')]),
-            (inputnode, dipy_tracking, [('FA', 'in_fa')]),
-            (inputnode, dipy_tracking, [
-             ('wm_mask_resampled', 'tracking_mask')]),
+            (inputnode, dipy_tracking, [('wm_mask_resampled', 'seed_mask'),
+                                        ('DWI', 'in_file'),
+                                        ('model', 'in_model'),
+                                        ('FA', 'in_fa'),
+                                        ('wm_mask_resampled', 'tracking_mask')]),
             (dipy_tracking, outputnode, [('tracks', 'track_file')])
         ])
 
     else:  # If CSD was used
-        if config.tracking_mode == 'Deterministic':
-
-            dipy_tracking = pe.Node(
-                interface=DirectionGetterTractography(), name='dipy_deterministic_tracking')
-            dipy_tracking.inputs.algo = 'deterministic'
-            dipy_tracking.inputs.num_seeds = config.number_of_seeds
-            dipy_tracking.inputs.fa_thresh = config.fa_thresh
-            dipy_tracking.inputs.max_angle = config.max_angle
-            dipy_tracking.inputs.step_size = config.step_size
-            dipy_tracking.inputs.use_act = config.use_act
-            dipy_tracking.inputs.use_act = config.seed_from_gmwmi
-            dipy_tracking.inputs.seed_density = config.seed_density
-
-            # dipy_tracking.inputs.fast_number_of_classes = config.fast_number_of_classes
-
-            if config.imaging_model == 'DSI':
-                dipy_tracking.inputs.recon_model = 'SHORE'
-            else:
-                dipy_tracking.inputs.recon_model = 'CSD'
-                dipy_tracking.inputs.recon_order = config.sh_order
-
-            if config.imaging_model == 'DSI':
-                flow.connect([
-                    (inputnode, dipy_tracking, [('fod_file', 'fod_file')]),
-                ])
-
-            flow.connect([
-                # (dipy_seeds,dipy_tracking,[('seed_files','seed_file')]),
-                (inputnode, dipy_tracking, [('DWI', 'in_file')]),
-                (inputnode, dipy_tracking, [
-                 ('partial_volumes', 'in_partial_volume_files')]),
-                (inputnode, dipy_tracking, [('model', 'in_model')]),
-                (inputnode, dipy_tracking, [('FA', 'in_fa')]),
-                (inputnode, dipy_tracking, [
-                 ('wm_mask_resampled', 'seed_mask')]),
-                (inputnode, dipy_tracking, [('gmwmi_file', 'gmwmi_file')]),
-                (inputnode, dipy_tracking, [
-                 ('wm_mask_resampled', 'tracking_mask')]),
-                (dipy_tracking, outputnode, [('tracks', 'track_file')])
-            ])
-
-        elif config.tracking_mode == 'Probabilistic':
+        # Both tracking modes share the same node, only the direction getter changes
+        algo = {'Deterministic': 'deterministic',
+                'Probabilistic': 'probabilistic'}.get(config.tracking_mode)
 
+        if algo is not None:
             dipy_tracking = pe.Node(
-                interface=DirectionGetterTractography(), name='dipy_probabilistic_tracking')
-            dipy_tracking.inputs.algo = 'probabilistic'
+                interface=DirectionGetterTractography(), name='dipy_%s_tracking' % algo)
+            dipy_tracking.inputs.algo = algo
             dipy_tracking.inputs.num_seeds = config.number_of_seeds
             dipy_tracking.inputs.fa_thresh = config.fa_thresh
             dipy_tracking.inputs.max_angle = config.max_angle
@@ -386,11 +338,6 @@ def create_dipy_tracking_flow(config):
                 dipy_tracking.inputs.recon_model = 'CSD'
                 dipy_tracking.inputs.recon_order = config.sh_order
 
-            # flow.connect([
-            #               (inputnode,dipy_tracking,[("bvals","bvals")]),
-            #               (inputnode,dipy_tracking,[("bvecs","bvecs")])
-            #             ])
-
             if config.imaging_model == 'DSI':
                 flow.connect([
                     (inputnode, dipy_tracking, [('fod_file', 'fod_file')]),
@@ -398,16 +345,13 @@ def create_dipy_tracking_flow(config):
 
             flow.connect([
                 # (dipy_seeds,dipy_tracking,[('seed_files','seed_file')]),
-                (inputnode, dipy_tracking, [('DWI', 'in_file')]),
-                (inputnode, dipy_tracking, [
-                 ('partial_volumes', 'in_partial_volume_files')]),
-                (inputnode, dipy_tracking, [('model', 'in_model')]),
-                (inputnode, dipy_tracking, [('FA', 'in_fa')]),
-                (inputnode, dipy_tracking, [
-                 ('wm_mask_resampled', 'seed_mask')]),
-                (inputnode, dipy_tracking, [('gmwmi_file', 'gmwmi_file')]),
-                (inputnode, dipy_tracking, [
-                 ('wm_mask_resampled', 'tracking_mask')]),
+                (inputnode, dipy_tracking, [('DWI', 'in_file'),
+                                            ('partial_volumes', 'in_partial_volume_files'),
+                                            ('model', 'in_model'),
+                                            ('FA', 'in_fa'),
+                                            ('wm_mask_resampled', 'seed_mask'),
+                                            ('gmwmi_file', 'gmwmi_file'),
+                                            ('wm_mask_resampled', 'tracking_mask')]),
                 (dipy_tracking, outputnode, [('tracks', 'track_file')])
             ])
 
@@ -422,7 +366,6 @@ def get_freesurfer_parcellation(roi_files):
     roi_files : list of traits.File
         List of parcellation files
     """
-    print("%s" % roi_files[0])
     return roi_files[0]
 
 
@@ -449,18 +392,7 @@ def create_mrtrix_tracking_flow(config):
     outputnode = pe.Node(interface=util.IdentityInterface(
         fields=["track_file"]), name='outputnode')
 
-    # Compute single fiber voxel mask
-    wm_erode = pe.Node(interface=Erode(out_filename="wm_mask_resampled.nii.gz"), name='wm_erode')
-    wm_erode.inputs.number_of_passes = 3
-    wm_erode.inputs.filtertype = 'erode'
-
-    flow.connect([
-        (inputnode, wm_erode, [("wm_mask_resampled", 'in_file')])
-    ])
-
     if config.tracking_mode == 'Deterministic':
-        mrtrix_seeds = pe.Node(
-            interface=Make_Mrtrix_Seeds(), name='mrtrix_seeds')
         mrtrix_tracking = pe.Node(
             interface=StreamlineTrack(), name='mrtrix_deterministic_tracking')
         mrtrix_tracking.inputs.desired_number_of_tracks = config.desired_number_of_tracks
@@ -470,30 +402,20 @@ def create_mrtrix_tracking_flow(config):
         mrtrix_tracking.inputs.step_size = config.step_size
         mrtrix_tracking.inputs.angle = config.angle
         mrtrix_tracking.inputs.cutoff_value = config.cutoff_value
+        # Generate the streamlines with the thread budget given to the pipeline, if any
+        if config.number_of_threads > 0:
+            mrtrix_tracking.inputs.nthreads = config.number_of_threads
+            mrtrix_tracking.n_procs = config.number_of_threads
 
+        mrtrix_tracking.inputs.inputmodel = 'SD_Stream'
         # mrtrix_tracking.inputs.args = '2>/dev/null'
+        # 4th-order Runge-Kutta integration is only worth its cost with a non-zero curvature
         if config.curvature >= 0.000001:
             mrtrix_tracking.inputs.rk4 = True
-            mrtrix_tracking.inputs.inputmodel = 'SD_Stream'
-        else:
-            mrtrix_tracking.inputs.inputmodel = 'SD_Stream'
         flow.connect([
             (inputnode, mrtrix_tracking, [("grad", "gradient_encoding_file")])
         ])
 
-        voxel2WorldMatrixExtracter = pe.Node(interface=ExtractHeaderVoxel2WorldMatrix(),
-                                             name='voxel2WorldMatrixExtracter')
-
-        flow.connect([
-            (inputnode, voxel2WorldMatrixExtracter,
-             [("wm_mask_resampled", "in_file")])
-        ])
-
-        flow.connect([
-            (inputnode, mrtrix_seeds, [('wm_mask_resampled', 'WM_file')]),
-            (inputnode, mrtrix_seeds, [('gm_registered', 'ROI_files')]),
-        ])
-
         if config.use_act:
             flow.connect([
                 (inputnode, mrtrix_tracking, [
@@ -553,8 +475,6 @@ def create_mrtrix_tracking_flow(config):
         ])
 
     elif config.tracking_mode == 'Probabilistic':
-        mrtrix_seeds = pe.Node(
-            interface=Make_Mrtrix_Seeds(), name='mrtrix_seeds')
         mrtrix_tracking = pe.Node(
             interface=StreamlineTrack(), name='mrtrix_probabilistic_tracking')
         mrtrix_tracking.inputs.desired_number_of_tracks = config.desired_number_of_tracks
@@ -564,6 +484,10 @@ def create_mrtrix_tracking_flow(config):
         mrtrix_tracking.inputs.step_size = config.step_size
         mrtrix_tracking.inputs.angle = config.angle
         mrtrix_tracking.inputs.cutoff_value = config.cutoff_value
+        # Generate the streamlines with the thread budget given to the pipeline, if any
+        if config.number_of_threads > 0:
+            mrtrix_tracking.inputs.nthreads = config.number_of_threads
+            mrtrix_tracking.n_procs = config.number_of_threads
         # mrtrix_tracking.inputs.args = '2>/dev/null'
         # if config.curvature >= 0.000001:
         #    mrtrix_tracking.inputs.rk4 = True
@@ -578,11 +502,6 @@ def create_mrtrix_tracking_flow(config):
 
         # orientation_matcher = pe.Node(interface=match_orientation(), name="orient_matcher")
 
-        flow.connect([
-            (inputnode, mrtrix_seeds, [('wm_mask_resampled', 'WM_file')]),
-            (inputnode, mrtrix_seeds, [('gm_registered', 'ROI_files')]),
-        ])
-
         if config.use_act:
             flow.connect([
                 (inputnode, mrtrix_tracking, [
@@ -467,7 +467,8 @@ class RegistrationStage(Stage):
 
             fsl_applyxfm_wm = pe.Node(
                 interface=fsl.ApplyXFM(
-                    apply_xfm=True, interp="nearestneighbour", out_file="wm_mask_registered.nii.gz"),
+                    apply_xfm=True, interp="nearestneighbour", datatype="char",
+                    out_file="wm_mask_registered.nii.gz"),
                 name="apply_registration_wm")
             fsl_applyxfm_rois = pe.Node(
                 interface=ApplymultipleXfm(), name="apply_registration_roivs")
@@ -140,8 +140,9 @@ def extract_base_directory(file):
     out_path : string
         Recon-all base directory
     """
-    # print("Extract reconall base dir : %s" % file[:-17])
-    out_path = str(file[:-17])
+    import os
+    # file is <subjects_dir>/<subject_id>/mri/orig/001.mgz
+    out_path = os.path.dirname(os.path.dirname(os.path.dirname(str(file))))
     return out_path
 
 
@@ -240,7 +241,6 @@ class SegmentationStage(Stage):
                         file : File
                             Output file
                         """
-                        # print "T1 is available"
                         return file
 
                     flow.connect([
@@ -281,7 +281,6 @@ class SegmentationStage(Stage):
                         file : File
                             Output file
                         """
-                        # print "Is available"
                         return file
 
                     flow.connect([
@@ -385,15 +384,18 @@ class SegmentationStage(Stage):
                         out : str
                             Freesurfer subject ID
                         """
-                        # print("Extract reconall base dir : %s" % file[:-18])
-                        out = file[:-18]
+                        import os
+                        # file is <subjects_dir>/<subject_id>/mri/brainmask.mgz
+                        out = os.path.dirname(os.path.dirname(file))
                         return out
 
+                    # -autorecon3 is passed along with the other flags, not on its own, to keep
+                    # -parallel/-openmp enabled for both autorecon2 and autorecon3
                     fs_reconall23 = pe.Node(interface=fs.ReconAll(
-                        flags='-no-isrunning -parallel -openmp {}'.format(self.config.number_of_threads)), name='reconall23')
+                        flags='-no-isrunning -autorecon3 -parallel -openmp {}'.format(self.config.number_of_threads)),
+                        name='reconall23')
                     fs_reconall23.inputs.directive = 'autorecon2'
                     fs_reconall23.inputs.args = self.config.freesurfer_args
-                    fs_reconall23.inputs.flags = '-autorecon3'
 
                     fs_reconall23.inputs.subjects_dir = self.config.freesurfer_subjects_dir
 
@@ -432,7 +434,6 @@ class SegmentationStage(Stage):
         debug : bool
             If `True`, show printed output
         """
-        # print "stage_dir : %s" % self.stage_dir
 
         if self.config.seg_tool == "Freesurfer":
             fs_path = ''
@@ -441,7 +442,6 @@ class SegmentationStage(Stage):
                     self.stage_dir, "reconall", "_report", "report.rst")
                 fs_path = self.config.freesurfer_subject_id
                 if os.path.exists(reconall_report_path):
-                    # print('Load pickle content')
                     if debug:
                         print("Read {}".format(reconall_report_path))
                     fs_path = extract_freesurfer_subject_dir(reconall_report_path, self.output_dir, debug=debug)
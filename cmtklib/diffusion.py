@@ -8,17 +8,19 @@
 
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import nibabel as nib
 import numpy as np
-import nibabel.trackvis as tv
 
 from nipype.interfaces.base import BaseInterface, BaseInterfaceInputSpec, File, TraitedSpec, OutputMultiPath, InputMultiPath
 from nipype.utils.filemanip import split_filename
+from nipype.utils.logger import logging
 
 from traits.trait_types import List, Str, Int, Enum
 
-from .util import length
+iflogger = logging.getLogger('nipype.interface')
 
 
 def compute_length_array(trkfile=None, streams=None, savefname='lengths.npy'):
@@ -29,8 +31,10 @@ def compute_length_array(trkfile=None, streams=None, savefname='lengths.npy'):
     trkfile : TRK file
         Path to the tractogram in TRK format
 
-    streams : the fibers data
-        The fibers from which we want to compute the length
+    streams : nibabel.streamlines.ArraySequence or list
+        The fibers from which we want to compute the length, either as
+        (N,3) arrays of points or as ``(points, scalars, properties)``
+        tuples as read by ``nibabel.trackvis``
 
     savefname : string
         Output filename to write the length array
@@ -42,18 +46,39 @@ def compute_length_array(trkfile=None, streams=None, savefname='lengths.npy'):
     """
     if streams is None and trkfile is not None:
         print("Compute length array for fibers in %s" % trkfile)
-        streams, hdr = tv.read(trkfile, as_generator=True)
-        n_fibers = hdr['n_count']
+        # Load all the fibers at once in a single ArraySequence buffer
+        trk = nib.streamlines.load(trkfile)
+        streams = trk.streamlines
+        n_fibers = len(streams)
         if n_fibers == 0:
             msg = "Header field n_count of trackfile %s is set to 0. No track seem to exist in this file." % trkfile
             print(msg)
             raise Exception(msg)
-    else:
-        n_fibers = len(streams)
 
-    leng = np.zeros(n_fibers, dtype=np.float)
-    for i, fib in enumerate(streams):
-        leng[i] = length(fib[0])
+    if isinstance(streams, nib.streamlines.ArraySequence):
+        # Work on the ArraySequence buffer directly (no copy as with get_data())
+        n_points = np.asarray(streams._lengths)
+        first = np.asarray(streams._offsets)
+        points = streams._data.reshape(-1, 3)
+    else:
+        # Stack the fibers ourselves: ArraySequence would drop fibers without any
+        # point and the lengths would no longer be aligned with the input list
+        fibers = [np.asarray(s[0] if isinstance(s, tuple) else s, dtype=np.float64).reshape(-1, 3)
+                  for s in streams]
+        n_points = np.array([len(f) for f in fibers], dtype=np.intp)
+        first = np.cumsum(n_points) - n_points
+        points = np.concatenate(fibers + [np.empty((0, 3))])
+
+    # Compute the length of all the segments of the buffer at once. The length
+    # of a fiber is then the difference of the cumulative segment length between
+    # its last and its first point (segments joining two fibers are never used).
+    segment_length = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    cum_length = np.concatenate(([0], np.cumsum(segment_length, dtype=np.float64)))
+    last = first + np.maximum(n_points - 1, 0)
+    # Clip to support fibers without any point
+    first = np.minimum(first, len(cum_length) - 1)
+    last = np.minimum(last, len(cum_length) - 1)
+    leng = cum_length[last] - cum_length[first]
 
     # store length array
     np.save(savefname, leng)
@@ -89,30 +114,28 @@ def filter_fibers(intrk, outtrk='', fiber_cutoff_lower=20, fiber_cutoff_upper=50
         base, ext = os.path.splitext(filename)
         outtrk = os.path.abspath(base + '_cutfiltered' + ext)
 
+    # load trackfile once (downside, needs everything in memory)
+    trk = nib.streamlines.load(intrk)
+    if len(trk.streamlines) == 0:
+        msg = "Header field n_count of trackfile %s is set to 0. No track seem to exist in this file." % intrk
+        print(msg)
+        raise Exception(msg)
+
     # compute length array
-    le = compute_length_array(intrk)
+    le = compute_length_array(streams=trk.streamlines)
 
     # cut the fibers smaller than value
     reducedidx = np.where((le > fiber_cutoff_lower) &
                           (le < fiber_cutoff_upper))[0]
 
-    # load trackfile (downside, needs everything in memory)
-    fibold, hdrold = tv.read(intrk)
-
     # rewrite the track vis file with the reduced number of fibers
-    outstreams = []
-    for i in reducedidx:
-        outstreams.append(fibold[i])
-
-    n_fib_out = len(outstreams)
-    hdrnew = hdrold.copy()
-    hdrnew['n_count'] = n_fib_out
+    outtractogram = trk.tractogram[reducedidx]
 
     # print("Compute length array for cutted fibers")
-    # le = compute_length_array(streams=outstreams)
+    # le = compute_length_array(streams=outtractogram.streamlines)
     print("Write out file: %s" % outtrk)
-    print("Number of fibers out : %d" % hdrnew['n_count'])
-    tv.write(outtrk, outstreams, hdrnew)
+    print("Number of fibers out : %d" % len(outtractogram))
+    nib.streamlines.save(outtractogram, outtrk, header=trk.header)
     print("File wrote : %d" % os.path.exists(outtrk))
 
     # ----
@@ -605,12 +628,106 @@ class UpdateGMWMInterfaceSeeding(BaseInterface):
         return outputs
 
 
+def _make_roi_seeds(ROI_file, WM_data, executor):
+    """Save one seed mask per label of a parcellation, restricted to the WM mask.
+
+    Parameters
+    ----------
+    ROI_file : string
+        Path to the parcellation image
+
+    WM_data : numpy.ndarray
+        White-matter mask data
+
+    executor : concurrent.futures.Executor
+        Executor shared by all parcellations, used to save the seed masks
+
+    Returns
+    -------
+    base_name : string
+        Base name of the parcellation file, used to name the seed files
+
+    ROI_idx : numpy.ndarray
+        Labels of the parcellation for which a seed mask was saved
+    """
+    ROI_vol = nib.load(ROI_file)
+    ROI_data = np.asanyarray(ROI_vol.dataobj).astype(np.int32)
+    ROI_affine = ROI_vol.get_affine()
+    # Extract ROI indexes by counting voxels of each label in one pass (0 is background)
+    counts = np.bincount(ROI_data.ravel())
+    ROI_idx = (np.nonzero(counts[1:])[0] + 1).astype(np.int32)
+    iflogger.debug("%d ROI labels: %s", len(ROI_idx), ROI_idx)
+    # Take overlap between dilated ROIs and WM to define seeding regions
+    border = np.multiply(ROI_data, WM_data, dtype=np.int32)
+    # Group the flat indices of the seeding voxels by label with a single sort,
+    # instead of rescanning the whole volume for each ROI
+    flat_border = border.ravel()
+    seed_voxels = np.flatnonzero(flat_border)
+    seed_voxels = seed_voxels[np.argsort(flat_border[seed_voxels], kind='stable')]
+    seed_labels = flat_border[seed_voxels]
+    starts = np.searchsorted(seed_labels, ROI_idx, side='left')
+    stops = np.searchsorted(seed_labels, ROI_idx, side='right')
+    # Save one nifti file per seeding ROI
+    _, base_name, _ = split_filename(ROI_file)
+
+    def save_seed(i, start, stop):
+        seed_data = np.zeros(border.size, dtype=np.uint8)
+        seed_data[seed_voxels[start:stop]] = 1
+        new_image = nib.Nifti1Image(seed_data.reshape(border.shape), ROI_affine)
+        new_image.set_data_dtype(np.uint8)
+        save_as = os.path.abspath(
+            base_name + '_seed_' + str(i) + '.nii.gz')
+        nib.save(new_image, save_as)
+
+    # Seed masks are independent and gzip compression releases the GIL.
+    # Wait for them so that only one parcellation is held in memory at a time
+    list(executor.map(save_seed, ROI_idx, starts, stops))
+
+    return base_name, ROI_idx
+
+
+def _make_roi_mrtrix_seeds(ROI_file, WM_data):
+    """Save the intersection of a parcellation with the WM mask as a single seed image.
+
+    Parameters
+    ----------
+    ROI_file : string
+        Path to the parcellation image
+
+    WM_data : numpy.ndarray
+        White-matter mask data
+
+    Returns
+    -------
+    base_name : string
+        Base name of the parcellation file, used to name the seed image
+    """
+    ROI_vol = nib.load(ROI_file)
+    ROI_data = np.asanyarray(ROI_vol.dataobj).astype(np.int32)
+    ROI_affine = ROI_vol.get_affine()
+    # Take overlap between dilated ROIs and WM to define seeding regions
+    border = np.multiply(ROI_data, WM_data, dtype=np.int32)
+    # Save all the seeding ROIs in a single nifti file
+    _, base_name, _ = split_filename(ROI_file)
+
+    new_image = nib.Nifti1Image(border, ROI_affine)
+    new_image.set_data_dtype(np.int32)
+    save_as = os.path.abspath(base_name + '_seeds.nii.gz')
+    nib.save(new_image, save_as)
+
+    return base_name
+
+
 class Make_SeedsInputSpec(BaseInterfaceInputSpec):
     ROI_files = InputMultiPath(
         File(exists=True), desc='ROI files registered to diffusion space')
 
     WM_file = File(
         mandatory=True, desc='WM mask file registered to diffusion space')
+
+    number_of_threads = Int(1, usedefault=True,
+                            desc='Number of threads used to process the ROI files '
+                                 '(set the n_procs of the node to match)')
     # DWI = File(mandatory=True,desc='Diffusion data file for probabilistic tractography')
 
 
@@ -641,46 +758,28 @@ class Make_Seeds(BaseInterface):
     base_name = ''
 
     def _run_interface(self, runtime):
-        print("Computing seed files for probabilistic tractography\n"
-              "===================================================")
+        iflogger.info("Computing seed files for probabilistic tractography")
         # Load ROI file
-        txt_file = open(self.base_name + '_seeds.txt', 'w')
-
-        print(self.inputs.ROI_files)
-
-        for ROI_file in self.inputs.ROI_files:
-            ROI_vol = nib.load(ROI_file)
-            ROI_data = ROI_vol.get_data()
-            ROI_affine = ROI_vol.get_affine()
-            # Load WM mask
-            WM_vol = nib.load(self.inputs.WM_file)
-            WM_data = WM_vol.get_data()
-            # Extract ROI indexes, define number of ROIs, overlap code and start ROI dilation
-            print("ROI dilation...")
-            tmp_data = np.unique(ROI_data[ROI_data != 0]).astype(int)
-            print(tmp_data.shape)
-            self.ROI_idx = np.unique(tmp_data).astype(int)
-            bins = np.arange(83)
-            counts = np.histogram(self.ROI_idx, bins=bins)
-            print(counts)
-            print(self.ROI_idx.shape)
-            print(self.ROI_idx)
-            # Take overlap between dilated ROIs and WM to define seeding regions
-            border = (np.multiply(ROI_data, WM_data)).astype(int)
-            # Save one nifti file per seeding ROI
-            temp = border.copy()
-            # print border.max
-            _, self.base_name, _ = split_filename(ROI_file)
-            for i in self.ROI_idx:
-                temp[border == i] = 1
-                temp[border != i] = 0
-                new_image = nib.Nifti1Image(temp, ROI_affine)
-                save_as = os.path.abspath(
-                    self.base_name + '_seed_' + str(i) + '.nii.gz')
-                txt_file.write(str(self.base_name + '_seed_' +
-                                   str(i) + '.nii.gz' + '\n'))
-                nib.save(new_image, save_as)
-        txt_file.close()
+        seeds_txt_file = self.base_name + '_seeds.txt'
+
+        iflogger.debug("ROI files: %s", self.inputs.ROI_files)
+
+        # Load WM mask (read as integer arrays instead of the float64 of get_data())
+        WM_vol = nib.load(self.inputs.WM_file)
+        WM_data = np.asanyarray(WM_vol.dataobj).astype(np.uint8)
+
+        # ROI files are processed in turn, the seed masks of each one concurrently
+        with ThreadPoolExecutor(max_workers=max(1, self.inputs.number_of_threads)) as executor:
+            results = [_make_roi_seeds(ROI_file, WM_data, executor)
+                       for ROI_file in self.inputs.ROI_files]
+
+        seed_names = [base_name + '_seed_' + str(i) + '.nii.gz\n'
+                      for base_name, ROI_idx in results for i in ROI_idx]
+        if results:
+            self.base_name, self.ROI_idx = results[-1]
+
+        with open(seeds_txt_file, 'w') as txt_file:
+            txt_file.writelines(seed_names)
         return runtime
 
     def _list_outputs(self):
@@ -718,36 +817,22 @@ class Make_Mrtrix_Seeds(BaseInterface):
     base_name = ''
 
     def _run_interface(self, runtime):
-        print(
-            "Computing seed files for probabilistic tractography\n===================================================")
+        iflogger.info("Computing seed files for probabilistic tractography")
         # Load ROI file
-        print(self.inputs.ROI_files)
-
-        for ROI_file in self.inputs.ROI_files:
-            ROI_vol = nib.load(ROI_file)
-            ROI_data = ROI_vol.get_data()
-            ROI_affine = ROI_vol.get_affine()
-            # Load WM mask
-            WM_vol = nib.load(self.inputs.WM_file)
-            WM_data = WM_vol.get_data()
-            # Extract ROI indexes, define number of ROIs, overlap code and start ROI dilation
-            print("ROI dilation...")
-            tmp_data = np.unique(ROI_data[ROI_data != 0]).astype(int)
-            print(tmp_data.shape)
-            self.ROI_idx = np.unique(tmp_data).astype(int)
-            bins = np.arange(83)
-            counts = np.histogram(self.ROI_idx, bins=bins)
-            print(counts)
-            print(self.ROI_idx.shape)
-            print(self.ROI_idx)
-            # Take overlap between dilated ROIs and WM to define seeding regions
-            border = (np.multiply(ROI_data, WM_data)).astype(int)
-            # Save one nifti file per seeding ROI
-            _, self.base_name, _ = split_filename(ROI_file)
-
-            new_image = nib.Nifti1Image(border, ROI_affine)
-            save_as = os.path.abspath(self.base_name + '_seeds.nii.gz')
-            nib.save(new_image, save_as)
+        iflogger.debug("ROI files: %s", self.inputs.ROI_files)
+
+        # Load WM mask (read as integer arrays instead of the float64 of get_data())
+        WM_vol = nib.load(self.inputs.WM_file)
+        WM_data = np.asanyarray(WM_vol.dataobj).astype(np.uint8)
+
+        # ROI files are independent: process them concurrently
+        n_workers = max(1, min(len(self.inputs.ROI_files), self.inputs.number_of_threads))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            base_names = list(executor.map(partial(_make_roi_mrtrix_seeds, WM_data=WM_data),
+                                           self.inputs.ROI_files))
+
+        if base_names:
+            self.base_name = base_names[-1]
         return runtime
 
     def _list_outputs(self):
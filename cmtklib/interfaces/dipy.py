@@ -811,7 +811,6 @@ class DirectionGetterTractography(DipyBaseInterface):
         imref = nib.four_to_three(img)[0]
         affine = img.affine
 
-        data = img.get_data().astype(np.float32)
         hdr = imref.header.copy()
         hdr.set_data_dtype(np.float32)
         hdr['data_type'] = 16
@@ -968,6 +967,10 @@ class DirectionGetterTractography(DipyBaseInterface):
             csd_model = pickle.load(f)
             f.close()
 
+            # The diffusion data are only needed to fit the CSD peaks, and are
+            # read directly as float32 instead of through a float64 copy
+            data = img.get_fdata(dtype=np.float32)
+
             IFLOGGER.info('Generating peaks from CSD model')
             pfm = peaks_from_model(model=csd_model,
                                    data=data,
@@ -991,7 +994,9 @@ class DirectionGetterTractography(DipyBaseInterface):
                                                                sphere=sphere)
         else:
             IFLOGGER.info('Loading SHORE FOD')
-            sh = nib.load(self.inputs.fod_file).get_data()
+            # Read the coefficients in their on-disk type, without caching them on
+            # the image: from_shcoeff converts them to float64 itself anyway
+            sh = np.asanyarray(nib.load(self.inputs.fod_file).dataobj)
             sh = np.nan_to_num(sh)
             IFLOGGER.info('Generating peaks from SHORE model')
             if self.inputs.algo == 'deterministic':
@@ -37,11 +37,10 @@ class ExtractHeaderVoxel2WorldMatrix(BaseInterface):
     output_spec = ExtractHeaderVoxel2WorldMatrixOutputSpec
 
     def _run_interface(self, runtime):
-        im = nib.load(self.inputs.in_file)
-        transform = np.array(im.get_affine())
+        transform = nib.load(self.inputs.in_file).affine
 
-        with open(os.path.abspath('voxel2world.txt'), 'a') as out_f:
-            np.savetxt(out_f, transform, delimiter=' ', fmt="%6.6g")
+        # Overwrite any matrix left by a previous run of the node
+        np.savetxt(os.path.abspath('voxel2world.txt'), transform, delimiter=' ', fmt="%6.6g")
 
         return runtime
 
@@ -1375,6 +1375,9 @@ class StreamlineTrackInputSpec(CommandLineInputSpec):
         requires=['act_file'],
         desc='seed from the grey matter - white matter interface (only valid if using ACT framework)')
 
+    nthreads = traits.Int(argstr='-nthreads %d', nohash=True,
+                          desc='number of threads used to generate the streamlines')
+
     out_file = File(argstr='%s', position=-1,
                     genfile=True, desc='output data file')
 